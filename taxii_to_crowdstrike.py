@@ -4,8 +4,8 @@
 # Developed by C.Brown (dev@coralesoft.nz)
 # This software is released under the MIT License.
 # See the LICENSE file in the project root for the full license text.
-# Last revised 11/10/2024
-# version 2024.10.6
+# Last revised 15/10/2026
+# version 2026.10.1
 #-----------------------------------------------------------------------
 # Version      Date         Notes:
 # 2024.10.1    08-10.2024   Initial Public Release
@@ -14,18 +14,53 @@
 # 2024.10.4    09.10.2024   Added improved token handling, error checking, and page-by-page processing
 # 2024.10.5    10.10.2024   Added configurable rate limiting 
 # 2024.10.6    11.10.2024   Added TAXII polling error handling
+# 2026.10.1    15.10.2026   Concurrent batched IOC push pipeline, typed STIX parsing, token refresh,
+#                           rate limit aware retries and PUSH_WORKERS/IOC_BATCH_SIZE/IOC_BATCH_WAIT/
+#                           REQUEST_TIMEOUT/LOG_LEVEL settings
 #-----------------------------------------------------------------------
 
 import os
+import re
+import json
 import requests
 import logging
+import queue
+import sys
+import xml.etree.ElementTree as ET
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from urllib.parse import quote
+from urllib3.util.retry import Retry
+
+# orjson is optional; when installed it is used for the much faster JSON encoding and decoding
+try:
+    import orjson
+except ImportError:
+    orjson = None
 from datetime import datetime, timedelta
+from logging.handlers import QueueHandler, QueueListener
 
 # Configure logging
 LOG_FILE = '/var/log/taxii_to_crowdstrike.log'
-logging.basicConfig(filename=LOG_FILE, level=logging.INFO, format='%(asctime)s - %(message)s')
+# Per-IOC and per-request details are logged at DEBUG; set LOG_LEVEL=DEBUG to see them
+LOG_LEVEL_NAME = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_LEVEL = logging.getLevelName(LOG_LEVEL_NAME)
+INVALID_LOG_LEVEL = not isinstance(LOG_LEVEL, int)
+if INVALID_LOG_LEVEL:
+    LOG_LEVEL = logging.INFO
+
+# Log to file and console, unless the importing application has already configured logging
+if not logging.getLogger().handlers:
+    _file_handler = logging.FileHandler(LOG_FILE)
+    _file_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+    _console_handler = logging.StreamHandler(sys.stdout)
+    _console_handler.setFormatter(logging.Formatter('%(message)s'))
+    logging.basicConfig(level=LOG_LEVEL, handlers=[_file_handler, _console_handler])
+if INVALID_LOG_LEVEL:
+    logging.warning("Invalid LOG_LEVEL %r, using INFO.", LOG_LEVEL_NAME)
 
 # Load API credentials from environment variables or default values
 CLIENT_ID = os.getenv('CLIENT_ID', 'your_client_id')
@@ -36,13 +71,105 @@ TAXII_PASSWORD = os.getenv('TAXII_PASSWORD', 'your_taxii_password')
 TAXII_COLLECTION = os.getenv('TAXII_COLLECTION', 'your_taxii_collection')
 
 # Rate limiting delay (in seconds) configurable via environment variable, default is 2 seconds
-RATE_LIMIT_DELAY = int(os.getenv('RATE_LIMIT_DELAY', 2))
+RATE_LIMIT_DELAY = float(os.getenv('RATE_LIMIT_DELAY', 2))
 MAX_RETRIES = 3
 
+# Timeout (in seconds) for connecting to and reading from the TAXII and CrowdStrike APIs, default is 30 seconds
+REQUEST_TIMEOUT = float(os.getenv('REQUEST_TIMEOUT', 30))
+
+# Number of IOC batches pushed to CrowdStrike concurrently, default is 8
+PUSH_WORKERS = int(os.getenv('PUSH_WORKERS', 8))
+if PUSH_WORKERS < 1:
+    raise ValueError(f"PUSH_WORKERS must be at least 1, got {PUSH_WORKERS}")
+
+# Number of IOCs sent to CrowdStrike in a single request, default is 200
+IOC_BATCH_SIZE = int(os.getenv('IOC_BATCH_SIZE', 200))
+if IOC_BATCH_SIZE < 1:
+    raise ValueError(f"IOC_BATCH_SIZE must be at least 1, got {IOC_BATCH_SIZE}")
+
+# Maximum time (in seconds) a partial batch waits for more IOCs before it is pushed, default is 1 second
+IOC_BATCH_WAIT = float(os.getenv('IOC_BATCH_WAIT', 1))
+
+# Maximum URL-encoded length of the list parameter in a single IOC lookup, keeping
+# request URLs well under the common 8 KB gateway limit
+MAX_QUERY_LENGTH = 4000
+
+# STIX pattern object paths mapped to CrowdStrike IOC types
+STIX_TYPE_MAP = {
+    "domain-name:value": "domain",
+    "ipv4-addr:value": "ipv4",
+    "ipv6-addr:value": "ipv6",
+    "file:hashes.'SHA-256'": "sha256",
+    "file:hashes.SHA256": "sha256",
+    "file:hashes.MD5": "md5",
+    "file:hashes.'MD5'": "md5",
+}
+STIX_PATTERN_RE = re.compile(r"\[\s*([\w-]+:[\w.'-]+)\s*=\s*'([^']+)'")
+
+class RateLimitRetry(Retry):
+    """urllib3 retry policy that also honours CrowdStrike's X-RateLimit-RetryAfter header.
+
+    POST and PATCH are only replayed when the server explicitly throttled them (429, or 503
+    with Retry-After); after any other gateway error the write may already have been applied.
+    """
+
+    WRITE_METHODS = frozenset(['POST', 'PATCH'])
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method.upper() in self.WRITE_METHODS:
+            if status_code == 429 or (status_code == 503 and has_retry_after):
+                return super().is_retry(method, status_code, has_retry_after)
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            # CrowdStrike sends the epoch time at which the rate limit resets
+            reset_at = response.headers.get('X-RateLimit-RetryAfter') or response.headers.get('X-RateLimit-Reset')
+            if reset_at:
+                try:
+                    retry_after = max(0.0, float(reset_at) - time.time())
+                except ValueError:
+                    retry_after = None
+        return retry_after
+
+# Throttled and transient gateway errors are retried inside the connection pool, sleeping
+# for the server-provided Retry-After when present and exponential backoff otherwise.
+# Read errors are never retried, and writes are only retried when throttled, as the server
+# may already have applied a POST or PATCH.
+HTTP_RETRY = RateLimitRetry(
+    total=MAX_RETRIES,
+    read=0,
+    backoff_factor=2,
+    status_forcelist=[429, 502, 503, 504],
+    allowed_methods=frozenset(['GET', 'POST', 'PATCH']),
+    respect_retry_after_header=True,
+    raise_on_status=False
+)
+
+# Shared HTTP session so TCP/TLS connections are reused across requests. The per-host pool
+# keeps one connection per push worker plus the TAXII poller, so concurrent requests never
+# queue behind each other or fall back to fresh handshakes when the pool overflows.
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=max(32, PUSH_WORKERS + 1), max_retries=HTTP_RETRY))
+
+def setup_logging():
+    """Move the root logger's handlers behind a queue so file and console writes happen on a background thread."""
+    root_logger = logging.getLogger()
+    handlers = root_logger.handlers[:]
+    for handler in handlers:
+        root_logger.removeHandler(handler)
+
+    log_queue = queue.Queue(-1)
+    root_logger.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
 def log(message):
     """Log message to file and console."""
     logging.info(message)
-    print(message)
 
 def retry(func, *args, **kwargs):
     """Retry function with exponential backoff."""
@@ -59,10 +186,58 @@ def retry(func, *args, **kwargs):
     log("The command has failed after maximum retry attempts.")
     return None
 
-def rate_limit():
-    """Rate limiting to control the request frequency."""
-    log(f"Rate limiting: Waiting for {RATE_LIMIT_DELAY} seconds before the next request...")
-    time.sleep(RATE_LIMIT_DELAY)
+def json_dumps(obj):
+    """Serialize an object to compact JSON bytes, using orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+def json_loads(content):
+    """Decode a JSON response body, using orjson when available."""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+class RateLimiter:
+    """Rate limiting to control the request frequency to one upstream API.
+
+    Reserves the next request slot so that request starts are at least `delay`
+    seconds apart across all worker threads. Time already spent waiting on the
+    server counts towards the interval.
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._next_request_at = 0.0
+
+    def wait(self):
+        """Block until the next request may start."""
+        # Rate limiting disabled: skip the lock, clock read and logging entirely
+        if self.delay <= 0:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_request_at - now
+            self._next_request_at = max(now, self._next_request_at) + self.delay
+        if wait > 0:
+            logging.debug("Rate limiting: Waiting for %.2f seconds before the next request...", wait)
+            time.sleep(wait)
+
+# TAXII and CrowdStrike are limited independently so polling and pushing can overlap
+TAXII_RATE_LIMITER = RateLimiter(RATE_LIMIT_DELAY)
+CROWDSTRIKE_RATE_LIMITER = RateLimiter(RATE_LIMIT_DELAY)
+
+def transform_stix_to_ioc(pattern):
+    """Extract a CrowdStrike IOC from a STIX indicator pattern, or None if unsupported."""
+    match = STIX_PATTERN_RE.search(pattern)
+    if not match:
+        return None
+    ioc_type = STIX_TYPE_MAP.get(match.group(1))
+    if not ioc_type:
+        return None
+    return {"type": ioc_type, "value": match.group(2)}
 
 def get_crowdstrike_token():
     """Retrieve CrowdStrike OAuth2 token."""
@@ -72,136 +247,350 @@ def get_crowdstrike_token():
         'client_id': CLIENT_ID,
         'client_secret': CLIENT_SECRET
     }
-    response = requests.post(url, data=data)
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    response = SESSION.post(url, headers=headers, data=data, timeout=REQUEST_TIMEOUT)
     if response.status_code == 200:
-        access_token = response.json().get('access_token')
+        token_data = json_loads(response.content)
         log("CrowdStrike OAuth2 token acquired.")
-        return access_token
+        return token_data.get('access_token'), token_data.get('expires_in', 1799)
     else:
         log(f"Failed to get OAuth2 token: {response.status_code} {response.text}")
         return None
 
-def poll_taxii_server():
-    """Poll TAXII server and handle pagination with error handling."""
-    log(f"Polling TAXII server at {TAXII_SERVER_URL} for collection {TAXII_COLLECTION}...")
+class TokenUnavailableError(RuntimeError):
+    """Raised when no usable CrowdStrike OAuth2 token can be obtained."""
+
+class TokenManager:
+    """Cache the CrowdStrike OAuth2 token and refresh it before it expires."""
+
+    # Refresh this many seconds before the token actually expires
+    EXPIRY_MARGIN = 30
+    # After a failed refresh, wait this many seconds before fetching again
+    FAILURE_BACKOFF = 30
+
+    def __init__(self):
+        self.token = None
+        self.expires_at = 0.0
+        self._failed_at = None
+        self._refresh_lock = threading.Lock()
+
+    def _is_valid(self):
+        return self.token is not None and time.monotonic() < self.expires_at - self.EXPIRY_MARGIN
+
+    def _usable_token(self):
+        # A token inside the refresh margin is still accepted until it actually expires
+        if self.token is not None and time.monotonic() < self.expires_at:
+            return self.token
+        return None
+
+    def get(self):
+        """Return a valid token, fetching a new one if it is missing or about to expire.
+
+        Returns None if no token could be obtained.
+        """
+        # Fast path without the lock, so workers holding a valid token never wait on a refresh
+        if self._is_valid():
+            return self.token
+        return self._refresh(self.token)
+
+    def invalidate(self, token):
+        """Refresh after a 401, unless another thread already replaced the rejected token."""
+        return self._refresh(token, rejected=True)
+
+    def backoff_remaining(self):
+        """Seconds until a failed refresh may be attempted again."""
+        if self._failed_at is None:
+            return 0.0
+        return max(0.0, self._failed_at + self.FAILURE_BACKOFF - time.monotonic())
+
+    def _refresh(self, stale_token, rejected=False):
+        # Single flight: one thread fetches while the others needing a token wait for its result
+        with self._refresh_lock:
+            if self.token != stale_token and self._is_valid():
+                return self.token
+            if rejected and self.token == stale_token:
+                # The API refused this token, so it must not be reused even if a refresh fails
+                self.token = None
+            if self.backoff_remaining() > 0:
+                return self._usable_token()
+
+            try:
+                result = get_crowdstrike_token()
+            except requests.RequestException as e:
+                log(f"Failed to get OAuth2 token: {e}")
+                result = None
+            if not result or not result[0]:
+                self._failed_at = time.monotonic()
+                return self._usable_token()
+
+            self.token, expires_in = result
+            self.expires_at = time.monotonic() + expires_in
+            self._failed_at = None
+            SESSION.headers['Authorization'] = f'Bearer {self.token}'
+            return self.token
+
+TOKEN_MANAGER = TokenManager()
+
+def crowdstrike_request(method, url, **kwargs):
+    """Send a rate limited CrowdStrike API request, refreshing the token and replaying once on 401."""
+    kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+    token = TOKEN_MANAGER.get()
+    if token is None:
+        raise TokenUnavailableError("No valid CrowdStrike OAuth2 token available")
+    CROWDSTRIKE_RATE_LIMITER.wait()
+    response = SESSION.request(method, url, **kwargs)
+    if response.status_code == 401:
+        log("CrowdStrike OAuth2 token rejected. Refreshing token and retrying request...")
+        if TOKEN_MANAGER.invalidate(token) is None:
+            raise TokenUnavailableError("No valid CrowdStrike OAuth2 token available")
+        CROWDSTRIKE_RATE_LIMITER.wait()
+        response = SESSION.request(method, url, **kwargs)
+    return response
+
+def fetch_taxii_page(next_token=None):
+    """Fetch one page from the TAXII server, returning None if polling should stop."""
+    # Add rate limiting between each request
+    TAXII_RATE_LIMITER.wait()
+
     headers = {'Content-Type': 'application/xml'}
     auth = HTTPBasicAuth(TAXII_USERNAME, TAXII_PASSWORD)
+    # ElementTree quotes and escapes the pagination token
+    poll_request = ET.Element('taxii_poll_request_xml')
+    if next_token:
+        poll_request.set('next', next_token)
+    data = ET.tostring(poll_request)
+    response = SESSION.post(f"{TAXII_SERVER_URL}/collections/{TAXII_COLLECTION}/poll", headers=headers, auth=auth, data=data, timeout=REQUEST_TIMEOUT)
+
+    # Error handling based on response status
+    if response.status_code == 200:
+        return json_loads(response.content)
+
+    elif response.status_code == 404:
+        log("Error: Collection not found at TAXII server. URL may be incorrect or collection may not exist. Exiting...")
+        return None
+
+    elif response.status_code == 401:
+        log("Error: Unauthorized access to TAXII server. Check your credentials. Exiting...")
+        return None
+
+    elif response.status_code == 500:
+        raise RuntimeError("Internal server error at TAXII server")
+    else:
+        raise RuntimeError(f"Received unexpected HTTP status code {response.status_code} from TAXII server")
+
+def parse_stix_objects(objects):
+    """Extract CrowdStrike IOCs from a list of STIX objects, skipping unsupported ones."""
+    iocs = []
+    for obj in objects:
+        if obj['type'] != 'indicator':
+            continue
+        ioc = transform_stix_to_ioc(obj['pattern'])
+        if ioc is not None:
+            iocs.append(ioc)
+    return iocs
+
+def poll_taxii_server():
+    """Poll TAXII server and yield the IOCs of each page as it arrives."""
+    log(f"Polling TAXII server at {TAXII_SERVER_URL} for collection {TAXII_COLLECTION}...")
     next_token = None
-    all_iocs = []
+    # (type, value) of every IOC already yielded, as feeds re-emit indicators across pages
+    seen = set()
 
     while True:
-        data = f"<taxii_poll_request_xml{' next=' + next_token if next_token else ''}/>"
-        response = requests.post(f"{TAXII_SERVER_URL}/collections/{TAXII_COLLECTION}/poll", headers=headers, auth=auth, data=data)
-
-        # Error handling based on response status
-        if response.status_code == 200:
-            taxii_data = response.json()
-            iocs = [obj['pattern'].split("'")[1] for obj in taxii_data.get('objects', []) if obj['type'] == 'indicator']
-            all_iocs.extend(iocs)
-            log(f"Retrieved {len(iocs)} IOCs from TAXII.")
-            
-        elif response.status_code == 404:
-            log("Error: Collection not found at TAXII server. URL may be incorrect or collection may not exist. Exiting...")
-            break
-
-        elif response.status_code == 401:
-            log("Error: Unauthorized access to TAXII server. Check your credentials. Exiting...")
+        taxii_data = retry(fetch_taxii_page, next_token)
+        if taxii_data is None:
             break
 
-        elif response.status_code == 500:
-            log("Error: Internal server error at TAXII server. Retrying...")
-        else:
-            log(f"Error: Received unexpected HTTP status code {response.status_code} from TAXII server. Retrying...")
-
-        # Add rate limiting between each request
-        rate_limit()
+        iocs = []
+        for ioc in parse_stix_objects(taxii_data.get('objects', [])):
+            key = (ioc['type'], ioc['value'])
+            if key not in seen:
+                seen.add(key)
+                iocs.append(ioc)
+        log(f"Retrieved {len(iocs)} new IOCs from TAXII.")
+        yield iocs
 
         next_token = taxii_data.get('next_token')
         if not next_token:
             break
 
-    return all_iocs
+def split_by_query_length(items, separator):
+    """Group items so each group, joined by separator, stays under MAX_QUERY_LENGTH once URL-encoded."""
+    groups = []
+    group = []
+    length = 0
+    separator_length = len(quote(separator, safe='='))
+    for item in items:
+        item_length = len(quote(item, safe='')) + separator_length
+        if group and length + item_length > MAX_QUERY_LENGTH:
+            groups.append(group)
+            group = []
+            length = 0
+        group.append(item)
+        length += item_length
+    if group:
+        groups.append(group)
+    return groups
 
-def check_ioc_exists_paginated(ioc_value, access_token):
-    """Check if IOC exists in CrowdStrike Falcon, handle pagination."""
-    url = f"https://api.crowdstrike.com/indicators/queries/iocs/v1?value={ioc_value}"
-    headers = {'Authorization': f'Bearer {access_token}'}
-    next_token = None
+def check_ioc_exists_paginated(ioc_values):
+    """Return a value -> IOC ID map for the IOC values that already exist in CrowdStrike Falcon, handle pagination."""
+    # The query endpoint only returns IOC IDs, which are resolved to values below.
+    # Values are quoted FQL strings, so backslashes and quotes inside them are escaped.
+    terms = ["'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'" for value in ioc_values]
+    ioc_ids = []
 
-    while True:
-        if next_token:
-            response = requests.get(f"{url}&next_token={next_token}", headers=headers)
-        else:
-            response = requests.get(url, headers=headers)
+    for group in split_by_query_length(terms, ','):
+        params = {'filter': "value:[" + ",".join(group) + "]", 'limit': 500}
+        while True:
+            response = crowdstrike_request('GET', "https://api.crowdstrike.com/indicators/queries/iocs/v1", params=params)
 
-        if response.status_code != 200:
-            log(f"Failed to check IOC: {response.status_code} {response.text}")
-            return False
+            if response.status_code != 200:
+                log(f"Failed to check IOCs: {response.status_code} {response.text}")
+                return {}
 
-        if response.json().get('resources'):
-            return True
+            body = json_loads(response.content)
+            ioc_ids.extend(body.get('resources') or [])
 
-        next_token = response.json().get('meta', {}).get('pagination', {}).get('next_token')
-        if not next_token:
-            break
+            next_token = body.get('meta', {}).get('pagination', {}).get('next_token')
+            if not next_token:
+                break
+            params['next_token'] = next_token
 
-    return False
+    wanted = set(ioc_values)
+    existing = {}
+    for group in split_by_query_length(ioc_ids, '&ids='):
+        response = crowdstrike_request('GET', "https://api.crowdstrike.com/indicators/entities/iocs/v1", params={'ids': group})
+
+        if response.status_code != 200:
+            log(f"Failed to look up existing IOCs: {response.status_code} {response.text}")
+            return {}
+
+        body = json_loads(response.content)
+        for resource in body.get('resources') or []:
+            if resource.get('value') in wanted:
+                existing[resource['value']] = resource['id']
+
+    return existing
 
 def calculate_expiration_date():
     """Calculate expiration date for IOC (3 months from now)."""
     expiration_date = datetime.utcnow() + timedelta(days=90)
     return expiration_date.strftime('%Y-%m-%dT%H:%M:%SZ')
 
-def push_iocs_to_crowdstrike(iocs, access_token):
-    """Push or update IOCs in CrowdStrike Falcon."""
-    log("Pushing or updating IOCs in CrowdStrike Falcon...")
-    headers = {'Authorization': f'Bearer {access_token}', 'Content-Type': 'application/json'}
-    
-    for ioc in iocs:
-        log(f"Processing IOC: {ioc}")
-        expiration_date = calculate_expiration_date()
-
-        if check_ioc_exists_paginated(ioc, access_token):
-            log(f"IOC {ioc} already exists. Updating...")
-            payload = {
-                "type": "domain",
-                "value": ioc,
-                "action": "detect",
-                "valid_until": expiration_date,
-                "source": "TAXII Import"
-            }
-            response = requests.patch("https://api.crowdstrike.com/indicators/entities/iocs/v1", headers=headers, json=payload)
-        else:
-            log(f"IOC {ioc} is new. Adding...")
-            payload = {
-                "type": "domain",
-                "value": ioc,
-                "action": "detect",
-                "valid_until": expiration_date,
-                "source": "TAXII Import"
-            }
-            response = requests.post("https://api.crowdstrike.com/indicators/entities/iocs/v1", headers=headers, json=payload)
+def push_ioc_batch(batch, expiration_date):
+    """Push or update a batch of IOCs in CrowdStrike Falcon with one request per action."""
+    logging.debug("Processing batch of %d IOCs...", len(batch))
+    start = time.monotonic()
+    existing = check_ioc_exists_paginated([ioc['value'] for ioc in batch])
+
+    # Fields shared by every indicator; new indicators add their type and value, while
+    # updates identify the stored indicator by its ID, as the bulk update body requires
+    template = {"action": "detect", "valid_until": expiration_date, "source": "TAXII Import"}
+    new_indicators = [dict(template, **ioc) for ioc in batch if ioc['value'] not in existing]
+    existing_indicators = [dict(template, id=existing[ioc['value']]) for ioc in batch if ioc['value'] in existing]
+
+    for method, indicators in (('POST', new_indicators), ('PATCH', existing_indicators)):
+        if not indicators:
+            continue
 
+        logging.debug("%s %d IOCs...", 'Adding' if method == 'POST' else 'Updating', len(indicators))
+        # The body is pre-encoded bytes, so the JSON content type must be set explicitly
+        response = crowdstrike_request(method, "https://api.crowdstrike.com/indicators/entities/iocs/v1",
+                                       headers={'Content-Type': 'application/json'}, data=json_dumps({"indicators": indicators}))
         if response.status_code not in (200, 201):
-            log(f"Failed to push/update IOC {ioc}: {response.status_code} {response.text}")
-        
-        # Add rate limiting between each IOC push
-        rate_limit()
+            log(f"Failed to push/update {len(indicators)} IOCs: {response.status_code} {response.text}")
+
+    log(f"Pushed batch of {len(batch)} IOCs in {time.monotonic() - start:.2f}s.")
+
+def batch_iocs(ioc_queue, batch_queue):
+    """Group queued IOCs into batches for the push workers until the producer signals the end."""
+    finished = False
+
+    while not finished:
+        ioc = ioc_queue.get()
+        if ioc is None:
+            break
+
+        # Flush when the batch is full or IOC_BATCH_WAIT has passed since its first IOC
+        batch = [ioc]
+        deadline = time.monotonic() + IOC_BATCH_WAIT
+        while len(batch) < IOC_BATCH_SIZE:
+            try:
+                ioc = ioc_queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if ioc is None:
+                finished = True
+                break
+            batch.append(ioc)
+
+        batch_queue.put(batch)
+
+    for _ in range(PUSH_WORKERS):
+        batch_queue.put(None)
+
+def push_iocs_to_crowdstrike(batch_queue, expiration_date):
+    """Push or update batches of IOCs from the queue until the batcher signals the end."""
+    while True:
+        batch = batch_queue.get()
+        if batch is None:
+            break
+
+        # The adapter already retries throttling and gateway errors, so only a missing token
+        # is worth waiting out; any other failure here is final
+        attempt = 1
+        while True:
+            try:
+                push_ioc_batch(batch, expiration_date)
+            except TokenUnavailableError as e:
+                if attempt < MAX_RETRIES:
+                    delay = max(TOKEN_MANAGER.backoff_remaining(), 1)
+                    log(f"{e}. Retrying batch of {len(batch)} IOCs in {delay:.0f} seconds...")
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+                log(f"Failed to push/update batch of {len(batch)} IOCs: {e}")
+            except Exception as e:
+                log(f"Failed to push/update batch of {len(batch)} IOCs: {e}")
+            break
+
+def queue_taxii_iocs(ioc_queue):
+    """Poll the TAXII server and feed IOCs into the queue, then signal the batcher to stop."""
+    try:
+        for iocs in poll_taxii_server():
+            for ioc in iocs:
+                ioc_queue.put(ioc)
+    finally:
+        ioc_queue.put(None)
 
 def main():
     log("TAXII to CrowdStrike IOC ingestion started.")
-    access_token = retry(get_crowdstrike_token)
-    
-    if not access_token:
+    if not TOKEN_MANAGER.get():
         log("Failed to obtain access token. Exiting.")
         return
     
-    iocs = retry(poll_taxii_server)
-    
-    if iocs:
-        retry(push_iocs_to_crowdstrike, iocs, access_token)
+    # All IOCs ingested in this run share the same expiration date
+    expiration_date = calculate_expiration_date()
+
+    # Poll TAXII on this thread while a single batcher groups IOCs and the push workers send
+    # the batches, so polling and pushing overlap; the bounded queues keep polling from
+    # running far ahead of pushing
+    ioc_queue = queue.Queue(maxsize=IOC_BATCH_SIZE * 2)
+    batch_queue = queue.Queue(maxsize=PUSH_WORKERS * 2)
+    log(f"Pushing or updating IOCs in CrowdStrike Falcon in batches of {IOC_BATCH_SIZE} with {PUSH_WORKERS} workers...")
+    with ThreadPoolExecutor(max_workers=PUSH_WORKERS + 1) as executor:
+        futures = [executor.submit(batch_iocs, ioc_queue, batch_queue)]
+        futures += [executor.submit(push_iocs_to_crowdstrike, batch_queue, expiration_date) for _ in range(PUSH_WORKERS)]
+        queue_taxii_iocs(ioc_queue)
+        for future in as_completed(futures):
+            future.result()
     
     log("IOC ingestion and management process complete.")
 
 if __name__ == '__main__':
-    main()
+    listener = setup_logging()
+    try:
+        main()
+    finally:
+        # Flush any queued log records before exiting
+        listener.stop()